@@ -1,119 +1,78 @@
 import sys
-import subprocess
-import re
 import os
+import io
 import configparser
+import functools
+import tempfile
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLabel, QLineEdit, QTableWidget, QTableWidgetItem,
                              QCheckBox, QSpinBox, QHeaderView, QAction, QMenu, QFileDialog, QMessageBox, QDialog,
                              QDialogButtonBox)
-from PyQt5.QtCore import QTimer, QThread, pyqtSignal, Qt
+from PyQt5.QtCore import QTimer, QProcess, Qt
 from PyQt5.QtGui import QFont, QIcon
 
 # Configuration file name
 CONFIG_FILE = "DellFanController.ini"
 
-
-# Function to get the absolute path of the script
-def get_script_path():
-    return os.path.dirname(os.path.realpath(sys.argv[0]))
+# Resolved once at import; realpath stats the filesystem, so don't repeat
+# it on every load/save.
+SCRIPT_PATH = os.path.dirname(os.path.realpath(sys.argv[0]))
+CONFIG_PATH = os.path.join(SCRIPT_PATH, CONFIG_FILE)
+DEFAULT_IPMITOOL = os.path.join(SCRIPT_PATH, "ipmitool", "ipmitool.exe")
+
+# Sensor name translations. Sensor names form a small closed set that
+# repeats every poll, so lookups are cached (exact match first, substring
+# scan only as fallback for names we haven't mapped verbatim).
+SENSOR_NAME_TRANSLATIONS = {
+    "Exhaust Temp": "排出空气温度",
+    "Inlet Temp": "进入空气温度",
+    "Temp": "CPU温度",
+    "Fan1 RPM": "风扇1转速",
+    "Fan2 RPM": "风扇2转速",
+    "Fan3 RPM": "风扇3转速",
+    "Fan4 RPM": "风扇4转速",
+    "Fan5 RPM": "风扇5转速",
+    "Fan6 RPM": "风扇6转速",
+}
 
 
 # Get ipmitool path, default to script directory if not found
 def get_default_ipmitool_path():
-    script_path = get_script_path()
-    ipmitool_path = os.path.join(script_path, "ipmitool", "ipmitool.exe")
-    if os.path.exists(ipmitool_path):
-        return ipmitool_path
+    if os.path.exists(DEFAULT_IPMITOOL):
+        return DEFAULT_IPMITOOL
     else:
         return ""
 
 
-class SensorDataThread(QThread):
-    data_ready = pyqtSignal(list)
-    error_occurred = pyqtSignal()  # Signal to indicate error
-
-    def __init__(self, ipmitool_path, ip, user, password):
-        super().__init__()
-        self.ipmitool_path = ipmitool_path
-        self.ip = ip
-        self.user = user
-        self.password = password
-
-    def run(self):
-        while True:
-            sensor_data = self.get_sensor_data()
-            if sensor_data is not None:  # Check if sensor_data is not None
-                if sensor_data:  # Check if sensor_data is not empty
-                    self.data_ready.emit(sensor_data)
-                else:
-                    self.error_occurred.emit()  # Emit error signal
-            self.sleep(5)
-
-    def get_sensor_data(self):
-        if not self.ip or not self.user or not self.password:
-            return None  # Don't attempt to fetch data if credentials are not set
-
-        try:
-            format_sensor = "-I lanplus -H {0} -U {1} -P {2} sensor"
-            parameters_sensor = format_sensor.format(self.ip, self.user, self.password)
-            full_command_sensor = f"{self.ipmitool_path} {parameters_sensor}"
-            result = self.execute_cmd(full_command_sensor)
-
-            if result:
-                sensor_data = self.parse_sensor_data(result)
-                return sensor_data
-            else:
-                print("Failed to retrieve sensor data.")
-                return []  # Return empty list to indicate error
-        except Exception as e:
-            print(f"Exception occurred: {e}")
-            return None
-
-    def parse_sensor_data(self, raw_output):
-        sensor_list = []
-        lines = raw_output.splitlines()
-        for line in lines:
-            if re.search(r'Temp|RPM', line):
-                sensor_list.append(line.split('|'))
-        return sensor_list
-
-    def execute_cmd(self, command):
-        try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            if result.returncode != 0:
-                print(f"Error executing command: {result.stderr}")
-            return result.stdout.strip()
-        except Exception as e:
-            print(f"Exception occurred: {e}")
-            return None
-
-
-class FanControlThread(QThread):
-    def __init__(self, ipmitool_path, function, args):
-        super().__init__()
-        self.ipmitool_path = ipmitool_path
-        self.function = function
-        self.args = args
-
-    def run(self):
-        self.function(*self.args)
-
-
 class DellFanControllerGUI(QMainWindow):
+    SHELL_PROMPT = "ipmitool> "  # Interactive shell prompt printed after each command
+
     def __init__(self):
         super().__init__()
         self.ipmitool_path = get_default_ipmitool_path()
         self.ip = ""
         self.user = ""
         self.password = ""
-        self.sensor_thread = None
+        # Persistent ipmitool shell session, driven asynchronously by a
+        # QTimer on the main event loop -- no worker thread, no blocking
+        # sleeps, and the process is cleaned up with the window.
+        self.sensor_proc = None
+        self._shell_buffer = ""
+        self._pending_prompts = 0
+        self._sensor_pending = False
+        self._sensor_warning_shown = False
+        self._table_initialized = False
+        self._item_pool = {}  # (row, col) -> QTableWidgetItem, reused across refreshes
+        self._last_fan_mode = None  # Last mode applied by auto-adjust
+        self.sensor_timer = QTimer(self)
+        self.sensor_timer.setInterval(self.POLL_INTERVAL)
+        self.sensor_timer.timeout.connect(self._poll_sensors)
         self.load_settings()  # Load settings from file
         self.loading_label = QLabel("正在加载传感器数据...")
         self.loading_label.setAlignment(Qt.AlignCenter)
         self.initUI()
         # Attempt to load sensor data on startup (after initUI)
-        self.start_sensor_thread()
+        self.start_sensor_session()
 
     def initUI(self):
         self.setWindowTitle('Dell Fan Controller/Dell服务器风扇控制器')
@@ -198,44 +157,77 @@ class DellFanControllerGUI(QMainWindow):
             self.auto_adjust_fan_speed(sensor_data)
 
     def populate_sensor_table(self, sensor_data):
+        # Suspend repaints and per-item dataChanged signals for the whole
+        # update so Qt issues one composite paint instead of one per cell.
+        self.sensor_table.setUpdatesEnabled(False)
+        self.sensor_table.blockSignals(True)
+        try:
+            self._populate_sensor_table(sensor_data)
+        finally:
+            self.sensor_table.blockSignals(False)
+            self.sensor_table.setUpdatesEnabled(True)
+            self.sensor_table.viewport().update()
+
+    def _populate_sensor_table(self, sensor_data):
         headers = ['传感器', '读数', '单位', '状态']
-        self.sensor_table.setRowCount(len(sensor_data))
-        self.sensor_table.setColumnCount(len(headers))
-        self.sensor_table.setHorizontalHeaderLabels(headers)
+        # Set the schema once; rebuilding headers and items every refresh
+        # forces Qt layout/paint work even when nothing changed.
+        if not self._table_initialized:
+            self.sensor_table.setColumnCount(len(headers))
+            self.sensor_table.setHorizontalHeaderLabels(headers)
+            self._table_initialized = True
+
+        # The row count only ever grows: shrinking would make QTableWidget
+        # delete the pooled items, so surplus rows are hidden instead and
+        # their items kept for the next time the sensor count bounces back.
+        rows = len(sensor_data)
+        grew = rows > self.sensor_table.rowCount()
+        if grew:
+            self.sensor_table.setRowCount(rows)
 
         for row, sensor in enumerate(sensor_data):
+            self.sensor_table.setRowHidden(row, False)
             for col, value in enumerate(sensor):
                 if col == 0:  # Sensor name
                     value = f"{self.translate_sensor_name(value)}"
                 elif col == 2:  # Units
                     value = f"{self.translate_unit(value)}"
 
-                item = QTableWidgetItem(str(value))
-                item.setTextAlignment(Qt.AlignCenter)
-                self.sensor_table.setItem(row, col, item)
-
-        self.sensor_table.resizeColumnsToContents()
-
-    def translate_sensor_name(self, sensor_name):
-        translations = {
-            "Exhaust Temp": "排出空气温度",
-            "Inlet Temp": "进入空气温度",
-            "Temp": "CPU温度",
-            "Fan1 RPM": "风扇1转速",
-            "Fan2 RPM": "风扇2转速",
-            "Fan3 RPM": "风扇3转速",
-            "Fan4 RPM": "风扇4转速",
-            "Fan5 RPM": "风扇5转速",
-            "Fan6 RPM": "风扇6转速",
-        }
-
-        for key, value in translations.items():
+                value = str(value)
+                item = self._item_pool.get((row, col))
+                if item is None:
+                    item = QTableWidgetItem(value)
+                    item.setTextAlignment(Qt.AlignCenter)
+                    self.sensor_table.setItem(row, col, item)
+                    self._item_pool[(row, col)] = item
+                elif item.text() != value:
+                    # Only touch the cell when the reading actually changed
+                    item.setText(value)
+
+        for row in range(rows, self.sensor_table.rowCount()):
+            self.sensor_table.setRowHidden(row, True)
+
+        if grew:
+            self.sensor_table.resizeColumnsToContents()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def translate_sensor_name(sensor_name):
+        # Names arrive already stripped from parse_sensor_data, so the
+        # exact lookup hits for every mapped sensor
+        translation = SENSOR_NAME_TRANSLATIONS.get(sensor_name)
+        if translation is not None:
+            return translation
+
+        for key, value in SENSOR_NAME_TRANSLATIONS.items():
             if key in sensor_name:
                 return value
 
         return sensor_name
 
-    def translate_unit(self, unit):
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def translate_unit(unit):
         if "RPM" in unit:
             return "转/分钟"
         elif "degrees C" in unit:
@@ -244,81 +236,211 @@ class DellFanControllerGUI(QMainWindow):
             return unit
 
     def reset_fan_control(self):
-        self.fan_control_thread = FanControlThread(self.ipmitool_path, self.execute_reset_fan_control,
-                                                   (self.ip, self.user, self.password))
-        self.fan_control_thread.start()
+        self._last_fan_mode = None  # Manual override; let auto-adjust re-apply
+        self._send_fan_commands(["raw 0x30 0x30 0x01 0x01"])
 
     def set_fan_speed(self):
         speed = self.speed_input.text() or "10"
-        self.fan_control_thread = FanControlThread(self.ipmitool_path, self.execute_set_fan_speed,
-                                                   (self.ip, self.user, self.password, speed))
-        self.fan_control_thread.start()
+        self._last_fan_mode = None  # Manual override; let auto-adjust re-apply
+        self._set_fan_speed(speed)
+
+    def _set_fan_speed(self, percent):
+        try:
+            percent_num = int(percent)
+        except ValueError:
+            print(f"Invalid fan speed: {percent}")
+            return
+        self._send_fan_commands(["raw 0x30 0x30 0x01 0x00",
+                                 f"raw 0x30 0x30 0x02 0xff 0x{percent_num:02x}"])
+
+    def _send_fan_commands(self, commands):
+        # Fan commands ride the persistent shell session: an async write to
+        # its stdin, with no per-command process spawn or worker thread.
+        if self.sensor_proc is None or self.sensor_proc.state() == QProcess.NotRunning:
+            self.start_sensor_session()
+        if self.sensor_proc is None:
+            self._show_settings_warning_once()
+            return
+        for command in commands:
+            self._shell_send(command)
 
     def toggle_auto_adjust(self, state):
         if state:
-            self.start_sensor_thread()  # Try to start when auto-adjust is checked
+            self.start_sensor_session()  # Try to start when auto-adjust is checked
         else:
-            if self.sensor_thread:
-                self.sensor_thread.quit()
-                self.sensor_thread = None
+            self.stop_sensor_session()
+
+    # Hysteresis around the threshold so the mode doesn't flap when the
+    # temperature hovers right at it
+    AUTO_ADJUST_HYSTERESIS = 3
 
     def auto_adjust_fan_speed(self, sensor_data):
         threshold = self.temp_threshold_input.value()
         max_temp = 0
         for sensor in sensor_data:
             if 'Temp' in sensor[0]:
-                try:
-                    temp = float(sensor[1])
-                    max_temp = max(max_temp, temp)
-                except ValueError:
-                    pass
+                # Sensors can report "na" or an empty reading; a cheap
+                # first-character check avoids raising ValueError every tick
+                value = sensor[1]
+                if not value or value[0] not in "0123456789-.":
+                    continue
+                temp = float(value)
+                if temp > max_temp:
+                    max_temp = temp
 
         if max_temp > threshold:
-            self.fan_control_thread = FanControlThread(self.ipmitool_path, self.execute_reset_fan_control,
-                                                       (self.ip, self.user, self.password))
-        else:
-            self.fan_control_thread = FanControlThread(self.ipmitool_path, self.execute_set_fan_speed,
-                                                       (self.ip, self.user, self.password, "10"))
-        self.fan_control_thread.start()
-
-    def execute_reset_fan_control(self, ip, user, password):
-        parameters_reset = f"-I lanplus -H {ip} -U {user} -P {password} raw 0x30 0x30 0x01 0x01"
-        full_command = f"{self.ipmitool_path} {parameters_reset}"
-        result = subprocess.run(full_command, shell=True, capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"Reset fan control succeeded: {result.stdout}")
+            mode = "reset"
+        elif max_temp <= threshold - self.AUTO_ADJUST_HYSTERESIS:
+            mode = "quiet"
         else:
-            print(f"Reset fan control failed: {result.stderr}")
+            mode = self._last_fan_mode or "quiet"
 
-    def execute_set_fan_speed(self, ip, user, password, percent):
-        try:
-            percent_num = int(percent)
-            parameters_disable_auto_mode = f"-I lanplus -H {ip} -U {user} -P {password} raw 0x30 0x30 0x01 0x00"
-            full_command_disable_auto_mode = f"{self.ipmitool_path} {parameters_disable_auto_mode}"
-            result_disable_auto_mode = subprocess.run(full_command_disable_auto_mode, shell=True,
-                                                     capture_output=True, text=True)
+        # Skip the ipmitool round trip entirely when the decision hasn't
+        # changed since the last tick
+        if mode == self._last_fan_mode:
+            return
+        self._last_fan_mode = mode
 
-            parameters_set_speed = f"-I lanplus -H {ip} -U {user} -P {password} raw 0x30 0x30 0x02 0xff 0x{percent_num:02x}"
-            full_command_set_speed = f"{self.ipmitool_path} {parameters_set_speed}"
-            result_set_speed = subprocess.run(full_command_set_speed, shell=True, capture_output=True, text=True)
+        if mode == "reset":
+            self._send_fan_commands(["raw 0x30 0x30 0x01 0x01"])
+        else:
+            self._set_fan_speed("10")
 
-            if result_disable_auto_mode.returncode == 0 and result_set_speed.returncode == 0:
-                print(f"Set fan speed to {percent}% succeeded.")
+    def start_sensor_session(self):
+        self.stop_sensor_session()
+        if not self.ip or not self.user or not self.password:
+            return  # Don't attempt to connect if credentials are not set
+
+        # Launch ipmitool once in interactive shell mode so the lanplus
+        # session (auth handshake) is established a single time and reused
+        # across polls instead of being paid on every command.
+        self.sensor_proc = QProcess(self)
+        self.sensor_proc.readyReadStandardOutput.connect(self._on_sensor_output)
+        self.sensor_proc.finished.connect(self._on_sensor_session_end)
+        # FailedToStart (empty/invalid ipmitool path) emits errorOccurred
+        # but never finished; route it to the same failure handler
+        self.sensor_proc.errorOccurred.connect(self._on_sensor_session_end)
+        # -N 1 -R 1: fail fast on a dead/slow BMC (1s timeout, 1 retry)
+        # instead of the default multi-second, multi-retry backoff; the
+        # timer tick respawns the session anyway.
+        self.sensor_proc.start(self.ipmitool_path,
+                               ["-I", "lanplus", "-H", self.ip,
+                                "-U", self.user, "-P", self.password,
+                                "-N", "1", "-R", "1", "shell"])
+        self._pending_prompts = 1  # The banner prompt printed at startup
+        self.sensor_timer.start()
+        self._poll_sensors()
+
+    def stop_sensor_session(self):
+        self.sensor_timer.stop()
+        self._shell_buffer = ""
+        self._pending_prompts = 0
+        self._sensor_pending = False
+        if self.sensor_proc is not None:
+            proc = self.sensor_proc
+            self.sensor_proc = None
+            proc.readyReadStandardOutput.disconnect(self._on_sensor_output)
+            proc.finished.disconnect(self._on_sensor_session_end)
+            proc.errorOccurred.disconnect(self._on_sensor_session_end)
+            proc.kill()
+            proc.deleteLater()
+
+    # Poll intervals (ms): normal cadence, and a relaxed one used while the
+    # window is minimized and nobody is consuming the readings for control
+    POLL_INTERVAL = 5000
+    POLL_INTERVAL_IDLE = 30000
+
+    def _poll_sensors(self):
+        # Back off while minimized with auto-adjust off: the table isn't
+        # visible and no control decision depends on fresh readings.
+        if self.isMinimized() and not self.auto_adjust_checkbox.isChecked():
+            self.sensor_timer.setInterval(self.POLL_INTERVAL_IDLE)
+        else:
+            self.sensor_timer.setInterval(self.POLL_INTERVAL)
+        if self.sensor_proc is None or self.sensor_proc.state() == QProcess.NotRunning:
+            self.start_sensor_session()  # Respawn a dead session
+            return
+        if self._sensor_pending:
+            return  # Previous poll still in flight
+        self._sensor_pending = True
+        # Query only the temperature and fan sensors instead of dumping
+        # the full sensor list; the IPMI traffic and parsing stay
+        # proportional to what the UI actually displays.
+        self._shell_send("sdr type Temperature")
+        self._shell_send("sdr type Fan")
+
+    def _shell_send(self, command):
+        self.sensor_proc.write((command + "\n").encode())
+        self._pending_prompts += 1
+
+    def _on_sensor_output(self):
+        data = bytes(self.sensor_proc.readAllStandardOutput())
+        self._shell_buffer += data.decode(errors="replace")
+        if self._shell_buffer.count(self.SHELL_PROMPT) < self._pending_prompts:
+            return  # Still waiting for command output to complete
+        # The prompt has no trailing newline, so each command's first output
+        # line arrives glued to it; strip prompts before parsing or sensor
+        # names come out as "ipmitool> Inlet Temp".
+        output = self._shell_buffer.replace(self.SHELL_PROMPT, "")
+        self._shell_buffer = ""
+        self._pending_prompts = 0
+        if self._sensor_pending:
+            self._sensor_pending = False
+            sensor_data = self.parse_sensor_data(output)
+            if sensor_data:
+                self._sensor_warning_shown = False
+                self.update_sensor_data(sensor_data)
             else:
-                print("Set fan speed failed.")
-        except Exception as e:
-            print(f"Exception occurred: {e}")
-
-    def start_sensor_thread(self):
-        if self.sensor_thread:
-            self.sensor_thread.quit()
-            self.sensor_thread = None
+                self._show_settings_warning_once()
+
+    def _on_sensor_session_end(self, *args):
+        # The shell died (bad credentials, unreachable BMC, killed process);
+        # flush partial state and let the next timer tick respawn it.
+        failed_poll = self._sensor_pending
+        self._shell_buffer = ""
+        self._pending_prompts = 0
+        self._sensor_pending = False
+        if failed_poll:
+            self._show_settings_warning_once()
+
+    def _show_settings_warning_once(self):
+        if self._sensor_warning_shown:
+            return
+        self._sensor_warning_shown = True
+        self.show_settings_warning()
 
-        self.sensor_thread = SensorDataThread(self.ipmitool_path, self.ip, self.user, self.password)
-        self.sensor_thread.data_ready.connect(self.update_sensor_data)
-        # Connect the error signal to the warning function
-        self.sensor_thread.error_occurred.connect(self.show_settings_warning)
-        self.sensor_thread.start()
+    def parse_sensor_data(self, raw_output):
+        # sdr output is pipe-delimited: name | id | status | entity | reading
+        # where the reading carries its unit (e.g. "23 degrees C", "4680 RPM").
+        # Normalize to [name, reading, unit, status] as the table expects.
+        # Walk the output with str.find rather than materializing a full
+        # splitlines() list, and bound the field split at the 5 fields we
+        # actually read.
+        sensor_list = []
+        start = 0
+        length = len(raw_output)
+        while start < length:
+            end = raw_output.find('\n', start)
+            line = raw_output[start:end if end != -1 else length]
+            # Plain substring tests beat the regex engine for a trivial
+            # two-needle alternation on these short lines.
+            if 'Temp' in line or 'RPM' in line:
+                fields = line.split('|', 4)
+                if len(fields) == 5:
+                    reading = fields[4].strip()
+                    value, _, unit = reading.partition(' ')
+                    if not value or value[0] not in "0123456789-.":
+                        # Non-numeric readings like "No Reading" have no
+                        # unit; show them whole instead of split in two
+                        value, unit = reading, ""
+                    # Strip once here so downstream translation and display
+                    # work on canonical strings instead of padded ones
+                    sensor_list.append((fields[0].strip(), value, unit,
+                                        fields[2].strip()))
+            if end == -1:
+                break
+            start = end + 1
+        return sensor_list
 
     def show_settings_warning(self):
         message = "你需要设置你的IDRAC信息后才能继续使用，检查并确认你的设置！"
@@ -392,24 +514,28 @@ class DellFanControllerGUI(QMainWindow):
         self.password = password
         self.ipmitool_path = ipmitool_path
         self._save_settings_to_file()  # Save settings to file, note the underscore in the method name
-        self.start_sensor_thread() # This line is crucial, it refreshes the sensor data after settings are saved
+        # Re-arm the one-shot warning: if the new settings still fail, the
+        # user should hear about it again
+        self._sensor_warning_shown = False
+        self.start_sensor_session() # This line is crucial, it refreshes the sensor data after settings are saved
         dialog.accept()
 
 
 
     def load_settings(self):
         config = configparser.ConfigParser()
-        config_path = os.path.join(get_script_path(), CONFIG_FILE)
-        if config.read(config_path):
-            try:
-                self.ip = config.get("Settings", "IP")
-                self.user = config.get("Settings", "Username")
-                self.password = config.get("Settings", "Password")
-                self.ipmitool_path = config.get("Settings", "ipmitool_path")
-            except configparser.NoOptionError:
-                print("Error reading options from configuration file.")
-                self.show_settings_warning()
-        else:
+        config.read(CONFIG_PATH)
+        # Read with fallbacks so a partial or malformed ini still populates
+        # whichever fields it has instead of aborting all four on the first
+        # missing option.
+        settings = config["Settings"] if config.has_section("Settings") else {}
+        self.ip = settings.get("IP", "")
+        self.user = settings.get("Username", "")
+        self.password = settings.get("Password", "")
+        self.ipmitool_path = settings.get("ipmitool_path", self.ipmitool_path)
+        # Gate on the config-sourced credentials only: ipmitool_path is
+        # auto-detected, so it is non-empty even on a fresh install with no ini
+        if not (self.ip or self.user or self.password):
             self.show_settings_warning()
 
     def _save_settings_to_file(self): # Renamed method to avoid recursive call
@@ -421,9 +547,23 @@ class DellFanControllerGUI(QMainWindow):
             "ipmitool_path": self.ipmitool_path
         }
 
-        config_path = os.path.join(get_script_path(), CONFIG_FILE)
-        with open(config_path, 'w') as configfile:
-            config.write(configfile)
+        buffer = io.StringIO()
+        config.write(buffer)
+        new_content = buffer.getvalue()
+
+        try:
+            with open(CONFIG_PATH, 'r') as configfile:
+                if configfile.read() == new_content:
+                    return  # Nothing changed; skip the write
+        except OSError:
+            pass
+
+        # Write to a temp file in the same directory and replace atomically
+        # so an interrupted save can't leave a truncated config behind.
+        with tempfile.NamedTemporaryFile('w', dir=SCRIPT_PATH,
+                                         delete=False) as tmp:
+            tmp.write(new_content)
+        os.replace(tmp.name, CONFIG_PATH)
 
 
 if __name__ == '__main__':